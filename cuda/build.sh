@@ -1,7 +1,11 @@
 #!/bin/bash -e
-python cugen-fast1-gray.py > fast1_gen.cu
+DTYPE="${DTYPE:-uchar}"
+python3 cugen-fast1-gray.py --dtype="$DTYPE" --header > fast1_pixel.h
+python3 cugen-fast1-gray.py --dtype="$DTYPE" > fast1_gen.cu
+python3 cugen-fast1-gray.py --target=cpu-avx2 > fast1_avx2_gen.cc
 python cugen-fast2-gray.py > fast2_gen.cu
 g++-4.4 -I../include/ -O3 -shared -fPIC -o libfastcl.so fastcl.cc
-nvcc -DCVD_IMAGE_DEBUG -arch=sm_23 --compiler-bindir=/usr/bin/gcc-4.4 -O3 -L./ -L../bin/ -lfastcl -lcvdcl -lcvd -lOpenCL -o bin-test fast.cu
+g++ -I../include/ -O3 -shared -fPIC -o libfastavx.so fastavx.cc
+nvcc -DCVD_IMAGE_DEBUG -DFAST_BX=16 -DFAST_BY=16 -arch=sm_23 --compiler-bindir=/usr/bin/gcc-4.4 -O3 -L./ -L../bin/ -lfastcl -lfastavx -lcvdcl -lcvd -lOpenCL -o bin-test fast.cu
 LD_LIBRARY_PATH=".:../bin:$LD_LIBRARY_PATH" ./bin-test
 
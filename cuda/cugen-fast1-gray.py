@@ -1,4 +1,4 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 #
 # Copyright (C) 2011  Dmitri Nikulin
 # Copyright (C) 2011  Monash University
@@ -24,28 +24,243 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
 # OTHER DEALINGS IN THE SOFTWARE.
 
+import argparse
+import sys
+
+# Pixel storage type, CUDA texel type, and signed type wide enough for pixel differences.
+DTYPES = {
+    "uchar":  ("unsigned char",  "uchar1",  "short"),
+    "ushort": ("unsigned short", "ushort1", "int"),
+    "float":  ("float",          "float1",  "float"),
+}
+
+parser = argparse.ArgumentParser(description="Generate the FAST stage 1 stencil.")
+parser.add_argument("--target", default="cuda", choices=["cuda", "cpu-avx2"],
+                    help="emit a CUDA kernel body, or C++ with AVX2 intrinsics")
+parser.add_argument("--ring", type=int, default=9, choices=range(9, 17),
+                    help="contiguous circle pixels required for a corner (FAST-N)")
+parser.add_argument("--dtype", default="uchar", choices=sorted(DTYPES),
+                    help="pixel type of the texture, shared tile and registers")
+parser.add_argument("--header", action="store_true",
+                    help="emit only the pixel types, included by fast.cu before the texture")
+args = parser.parse_args()
+
+if (args.target == "cpu-avx2") and (args.dtype != "uchar"):
+    parser.error("--target=cpu-avx2 supports only --dtype=uchar")
+if (args.target == "cpu-avx2") and args.header:
+    parser.error("--header applies only to --target=cuda")
+
+(PIXEL, TEXEL, DIFF) = DTYPES[args.dtype]
+
+# The texture, shared tile and registers all take their types from
+# this header, so that they cannot disagree.
+if args.header:
+    sys.stdout.write(f"""// Generated for {args.dtype} pixels.
+
+#define FAST_PIXEL {PIXEL}
+#define FAST_TEXEL {TEXEL}
+#define FAST_DIFF  {DIFF}
+""")
+    sys.exit(0)
+
 # 2D offsets from "corner" candidate pixel.
-# Corresponds to SUBSET OF lines 17-32 in fast_9_detect.cxx
+# Corresponds to lines 17-32 in fast_9_detect.cxx
 OFFSETS = [
     ( 0,  3),
+    ( 1,  3),
+    ( 2,  2),
+    ( 3,  1),
     ( 3,  0),
+    ( 3, -1),
+    ( 2, -2),
+    ( 1, -3),
     ( 0, -3),
+    (-1, -3),
+    (-2, -2),
+    (-3, -1),
     (-3,  0),
+    (-3,  1),
+    (-2,  2),
+    (-1,  3),
 ]
 
-for (shift, (x, y)) in enumerate(OFFSETS, 1):
-    print ("    int const p%02d = tex2D(testImage, x + %2d, y + %2d).x;" % (shift, x, y))
-print
-
-print "    // Check the absolute difference of each circle pixel."
-for (shift, _) in enumerate(OFFSETS, 1):
-    print ("    int const d%02d = (abs(p%02d - p00) > FAST_THRESH);" % (shift, shift))
-print
-
-print "    // Check if any two adjacent circle pixels have a high absolute difference."
-print "    int const isCorner = ("
-print " ||\n".join([
-    ("        (d%02d && d%02d)" % (shift, (shift % len(OFFSETS)) + 1))
-    for (shift, _) in enumerate(OFFSETS, 1)
-])
-print "    );"
+# Number the circle pixels once, and emit every stanza from the same table.
+ROWS = [(shift, x, y) for (shift, (x, y)) in enumerate(OFFSETS, 1)]
+NROW = len(ROWS)
+
+# Radius of the circle, giving the apron around each shared-memory tile.
+APRON = max(max(abs(x), abs(y)) for (x, y) in OFFSETS)
+
+# Shifts that reduce a doubled 16-bit pattern to its runs of args.ring set bits.
+# After each shift by n, bit i is set only if bits i..i+(2n-1) were all set;
+# a final partial shift tops the run up to exactly args.ring.
+SHIFTS = []
+have = 1
+while (have * 2) <= args.ring:
+    SHIFTS.append(have)
+    have *= 2
+if have < args.ring:
+    SHIFTS.append(args.ring - have)
+
+def emit_cpu_avx2():
+    # Each stage ANDs every circle mask with the mask n places further
+    # round the circle, exactly as the CUDA shifts do on a doubled word.
+    stages = []
+    prev = "0"
+    for (stage, n) in enumerate(SHIFTS, 1):
+        for kind in ("b", "d"):
+            stages.append("\n".join(
+                f"    __m256i const {kind}{stage}_{s:02d} = _mm256_and_si256({kind}{prev}_{s:02d}, {kind}{prev}_{(s - 1 + n) % NROW + 1:02d});"
+                for (s, _, _) in ROWS
+            ))
+        prev = str(stage)
+
+    loads = "\n".join(
+        f"    __m256i const p{s:02d} = _mm256_loadu_si256((__m256i const *) (row + ({y:2d} * stride) + {x:2d}));"
+        for (s, x, y) in ROWS
+    )
+
+    marks = "\n".join(
+        f"    __m256i const b0_{s:02d} = _mm256_andnot_si256(_mm256_cmpeq_epi8(_mm256_subs_epu8(_mm256_subs_epu8(p{s:02d}, p00), thresh), zero), ones);\n"
+        f"    __m256i const d0_{s:02d} = _mm256_andnot_si256(_mm256_cmpeq_epi8(_mm256_subs_epu8(_mm256_subs_epu8(p00, p{s:02d}), thresh), zero), ones);"
+        for (s, _, _) in ROWS
+    )
+
+    arcs = "\n".join(
+        f"    arcs = _mm256_or_si256(arcs, _mm256_or_si256(b{prev}_{s:02d}, d{prev}_{s:02d}));"
+        for (s, _, _) in ROWS
+    )
+
+    stages = "\n\n".join(stages)
+
+    sys.stdout.write(f"""// Generated for the cpu-avx2 target; tests 32 adjacent pixels at once.
+// Expects "row" pointing at the first center pixel and "stride" in bytes.
+
+#if FAST_RING != {args.ring}
+#error "fast1_avx2_gen.cc was generated for a different FAST_RING"
+#endif
+
+    // Constant vectors.
+    __m256i const zero   = _mm256_setzero_si256();
+    __m256i const ones   = _mm256_set1_epi8((char) 0xFF);
+    __m256i const thresh = _mm256_set1_epi8((char) FAST_THRESH);
+
+    // Read center pixels.
+    __m256i const p00 = _mm256_loadu_si256((__m256i const *) row);
+
+    // Read circle pixels.
+{loads}
+
+    // Mark circle pixels much brighter (b) or darker (d) than the center pixel,
+    // using saturating subtraction so that no widening is needed.
+{marks}
+
+    // Reduce to runs of {args.ring} contiguous circle pixels.
+{stages}
+
+    // Any surviving run proves a contiguous bright or dark arc.
+    __m256i arcs = zero;
+{arcs}
+
+    // Gather one bit per center pixel.
+    unsigned int const isCorner = (unsigned int) _mm256_movemask_epi8(arcs);
+""")
+
+
+if args.target == "cpu-avx2":
+    emit_cpu_avx2()
+    sys.exit(0)
+
+reads = "\n".join(
+    f"    FAST_PIXEL const p{s:02d} = tile[ty + {y:2d}][tx + {x:2d}];"
+    for (s, x, y) in ROWS
+)
+
+diffs = "\n".join(
+    f"    FAST_DIFF const d{s:02d} = ((FAST_DIFF) p{s:02d} - (FAST_DIFF) p00);"
+    for (s, _, _) in ROWS
+)
+
+bright = " |\n".join(
+    f"        ((d{s:02d} >  FAST_THRESH) << {s - 1:2d})"
+    for (s, _, _) in ROWS
+)
+
+dark = " |\n".join(
+    f"        ((d{s:02d} < -FAST_THRESH) << {s - 1:2d})"
+    for (s, _, _) in ROWS
+)
+
+runs = "\n".join(
+    f"    bright &= (bright >> {n}); dark &= (dark >> {n});"
+    for n in SHIFTS
+)
+
+sys.stdout.write(f"""// Pixel types come from fast1_pixel.h, see --header.
+
+#ifndef FAST_PIXEL
+#error "fast1_pixel.h must be included before fast1_gen.cu"
+#endif
+
+#if FAST_RING != {args.ring}
+#error "fast1_gen.cu was generated for a different FAST_RING"
+#endif
+
+#if !defined(FAST_BX) || !defined(FAST_BY)
+#error "FAST_BX and FAST_BY must be defined at build time"
+#endif
+
+    // Stage the block's pixels and their apron in shared memory,
+    // so that neighbouring threads do not re-read the same texels.
+    __shared__ FAST_PIXEL tile[FAST_BY + {APRON * 2}][FAST_BX + {APRON * 2}];
+
+    {{
+        // Image position of the tile's top-left pixel.
+        int const x0 = ((blockIdx.x * FAST_BX) + X_OFF - {APRON});
+        int const y0 = ((blockIdx.y * FAST_BY) + Y_OFF - {APRON});
+
+        // Cooperatively load the tile, striding by the block size.
+        for (int ltid = ((threadIdx.y * FAST_BX) + threadIdx.x);
+                 ltid < ((FAST_BX + {APRON * 2}) * (FAST_BY + {APRON * 2}));
+                 ltid += (FAST_BX * FAST_BY)) {{
+            int const lx = (ltid % (FAST_BX + {APRON * 2}));
+            int const ly = (ltid / (FAST_BX + {APRON * 2}));
+            tile[ly][lx] = tex2D(testImage, x0 + lx, y0 + ly).x;
+        }}
+    }}
+
+    __syncthreads();
+
+    // Position of this thread's center pixel within the tile.
+    int const tx = (threadIdx.x + {APRON});
+    int const ty = (threadIdx.y + {APRON});
+
+    // Read center pixel.
+    FAST_PIXEL const p00 = tile[ty][tx];
+
+    // Read circle pixels from the tile.
+{reads}
+
+    // Calculate signed difference of each circle pixel.
+{diffs}
+
+    // Mark circle pixels much brighter than the center pixel.
+    uint const brightBits = (
+{bright}
+    );
+
+    // Mark circle pixels much darker than the center pixel.
+    uint const darkBits = (
+{dark}
+    );
+
+    // Duplicate bit patterns to simulate barrel shift.
+    uint bright = (brightBits | (brightBits << 16));
+    uint dark   = (darkBits   | (darkBits   << 16));
+
+    // Reduce to runs of {args.ring} contiguous circle pixels.
+{runs}
+
+    // Any surviving bit proves a contiguous bright or dark arc.
+    int const isCorner = ((bright | dark) != 0);
+""")
@@ -30,14 +30,20 @@
 
 #include "common.h"
 
+// Pixel types chosen by cugen-fast1-gray.py --header.
+#include "fast1_pixel.h"
+
 // Number of threads per 1D group.
 #define NTHREADS 512
 
 // Prototype for external OpenCL FAST
 void clfast(CVD::Image<CVD::byte> const & image);
 
-// Declare 1-byte read-only texture object.
-texture<uchar1, 2, cudaReadModeElementType> static testImage;
+// Prototype for external AVX2 FAST
+void avxfast(CVD::Image<CVD::byte> const & image);
+
+// Declare read-only texture object, with the generated pixel type.
+texture<FAST_TEXEL, 2, cudaReadModeElementType> static testImage;
 
 __device__ int mask_test(uint x16) {
     // Duplicate bit pattern to simulate barrel shift.
@@ -65,11 +71,9 @@ __global__ void fast1_kernel(
     int const x = ((blockIdx.x * blockDim.x) + threadIdx.x + X_OFF);
     int const y = ((blockIdx.y * blockDim.y) + threadIdx.y + Y_OFF);
 
-    // Read center pixel, upcast to int.
-    int const p00 = tex2D(testImage, x, y).x;
-
     // Include generated code here.
-    // Checks ring of pixels, and populates the boolean "isCorner".
+    // Stages a shared tile, reads the center pixel "p00",
+    // checks ring of pixels, and populates the boolean "isCorner".
     #include "fast1_gen.cu"
 
     if (isCorner) {
@@ -113,11 +117,14 @@ __global__ void fast2_kernel(
 }
 
 static void cufast(CVD::Image<CVD::byte> const & image) {
-    // Re-interpret image pointer.
-    uchar1 const * const data = reinterpret_cast<uchar1 const *>(image.data());
     int const nx = image.size().x;
     int const ny = image.size().y;
 
+    // Convert pixels to the texel type, keeping their values.
+    std::vector<FAST_TEXEL> data(nx * ny);
+    for (int i = 0; i < (nx * ny); i++)
+        data[i].x = (FAST_PIXEL) image.data()[i];
+
     // Configure texture object.
     testImage.addressMode[0] = cudaAddressModeClamp;
     testImage.addressMode[1] = cudaAddressModeClamp;
@@ -125,14 +132,14 @@ static void cufast(CVD::Image<CVD::byte> const & image) {
     testImage.normalized     = false;
 
     // Create channel descriptor.
-    cudaChannelFormatDesc const format = cudaCreateChannelDesc(8, 0, 0, 0, cudaChannelFormatKindUnsigned);
+    cudaChannelFormatDesc const format = cudaCreateChannelDesc<FAST_TEXEL>();
 
     // Allocate texture array.
     cudaArray * buffer = NULL;
     cudaMallocArray(&buffer, &format, nx, ny);
 
     // Populate texture array.
-    cudaMemcpyToArray(buffer, 0, 0, data, nx * ny * sizeof(uchar1), cudaMemcpyHostToDevice);
+    cudaMemcpyToArray(buffer, 0, 0, &(data[0]), nx * ny * sizeof(FAST_TEXEL), cudaMemcpyHostToDevice);
     cudaBindTextureToArray(testImage, buffer, format);
 
     // Allocate corner array 1.
@@ -157,7 +164,8 @@ static void cufast(CVD::Image<CVD::byte> const & image) {
     cudaMemcpy(icorner2, &zero, sizeof(zero), cudaMemcpyHostToDevice);
 
     // Create work grid 1.
-    dim3 const dimBlock1(16, 16, 1);
+    // Block shape must match the shared tile in fast1_gen.cu.
+    dim3 const dimBlock1(FAST_BX, FAST_BY, 1);
     dim3 const dimGrid1((nx - (X_OFF * 2)) / dimBlock1.x, (ny - (Y_OFF * 2)) / dimBlock1.y, 1);
 
     // Warmup.
@@ -255,6 +263,7 @@ int main(int argc, char **argv) {
     // Benchmark all implementations.
     cufast(keepImage);
     clfast(keepImage);
+    avxfast(keepImage);
     cxxfast(keepImage);
 
     return 0;
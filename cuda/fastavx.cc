@@ -0,0 +1,93 @@
+// Copyright (C) 2011  Dmitri Nikulin
+// Copyright (C) 2011  Monash University
+//
+// Permission is hereby granted, free of charge, to any person
+// obtaining a copy of this software and associated documentation
+// files (the "Software"), to deal in the Software without
+// restriction, including without limitation the rights to use,
+// copy, modify, merge, publish, distribute, sublicense, and/or sell
+// copies of the Software, and to permit persons to whom the
+// Software is furnished to do so, subject to the following
+// conditions:
+//
+// The above copyright notice and this permission notice shall be
+// included in all copies or substantial portions of the Software.
+//
+// THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+// EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+// OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+// NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+// HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+// WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+// FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+// OTHER DEALINGS IN THE SOFTWARE.
+
+#include "common.h"
+
+#include <immintrin.h>
+
+// Search one pass of the image with AVX2.
+// Only this function is compiled for AVX2, so that the
+// rest of the benchmark still runs on CPUs without it.
+__attribute__((target("avx2")))
+static void avxfind(CVD::Image<CVD::byte> const & image, std::vector<CVD::ImageRef> & corners) {
+    int const nx = image.size().x;
+    int const ny = image.size().y;
+
+    // Distance between rows in bytes.
+    int const stride = image.row_stride();
+
+    corners.clear();
+
+    for (int y = Y_OFF; y < (ny - Y_OFF); y++) {
+        // Test 32 pixels per step, leaving any remainder
+        // as the CUDA kernel leaves a partial block.
+        for (int x = X_OFF; (x + 32) <= (nx - X_OFF); x += 32) {
+            CVD::byte const * const row = (image[y] + x);
+
+            // Include generated code here.
+            // Reads the center pixels and their circles,
+            // and populates the bit mask "isCorner".
+            #include "fast1_avx2_gen.cc"
+
+            // Append one corner per set bit.
+            for (unsigned int bits = isCorner; bits != 0; bits &= (bits - 1)) {
+                if (corners.size() < FAST_COUNT)
+                    corners.push_back(CVD::ImageRef(x + __builtin_ctz(bits), y));
+            }
+        }
+    }
+}
+
+void avxfast(CVD::Image<CVD::byte> const & image) {
+    std::cerr << "AVX2" << std::endl;
+
+    // Skip rather than fault on CPUs without AVX2.
+    if (!__builtin_cpu_supports("avx2")) {
+        std::cerr << "  skipped, not supported by this CPU" << std::endl;
+        std::cerr << std::endl;
+        return;
+    }
+
+    // Prepare corner buffer.
+    std::vector<CVD::ImageRef> corners;
+    corners.reserve(FAST_COUNT);
+
+    long const time1 = time(NULL);
+
+    for (int i = 0; i < REPEAT; i++)
+        avxfind(image, corners);
+
+    long const time2 = time(NULL);
+
+    // Read number of corners.
+    int const ncorners1 = corners.size();
+
+    // Calculate microseconds per pass.
+    int const us1 = (((time2 - time1) * 1000000) / REPEAT);
+
+    // Report timing and number of corners.
+    std::cerr << std::setw(12) << ncorners1 << " corners 1" << std::endl;
+    std::cerr << std::setw(12) << us1 << " microseconds 1" << std::endl;
+    std::cerr << std::endl;
+}
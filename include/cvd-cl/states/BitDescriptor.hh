@@ -27,6 +27,10 @@
 
 #include <cvd-cl/core/Bits.hh>
 
+#if defined(__AVX512VPOPCNTDQ__) && defined(__AVX512VL__)
+#include <immintrin.h>
+#endif
+
 namespace CVD {
 namespace CL  {
 
@@ -99,6 +103,42 @@ int errorBitDescriptors(BDT const & tdesc, BDT const & rdesc) {
     return memBitCount(&trand, sizeof(BDT));
 }
 
+// Specialised code for cl_ulong4 (256-bit) descriptors,
+// as searched by HipsTreeFindStep. Selected at compile time,
+// so builds with -march=native use the host's best popcount.
+
+/// \brief Count set bits in the 4 lanes of \a desc.
+///
+/// \param desc  Descriptor.
+/// \return Number of set bits.
+inline int bitCountULong4(cl_ulong4 const & desc) {
+#if defined(__AVX512VPOPCNTDQ__) && defined(__AVX512VL__)
+    // One VPOPCNTQ for all lanes, then a horizontal add.
+    __m256i const lanes = _mm256_popcnt_epi64(_mm256_loadu_si256((__m256i const *) desc.s));
+    __m128i const pairs = _mm_add_epi64(_mm256_castsi256_si128(lanes), _mm256_extracti128_si256(lanes, 1));
+    return int(_mm_cvtsi128_si64(pairs) + _mm_extract_epi64(pairs, 1));
+#else
+    return (__builtin_popcountll(desc.s[0]) + __builtin_popcountll(desc.s[1]) +
+            __builtin_popcountll(desc.s[2]) + __builtin_popcountll(desc.s[3]));
+#endif
+}
+
+template<>
+inline int diffBitDescriptors<cl_ulong4>(cl_ulong4 const & idesc1, cl_ulong4 const & idesc2) {
+    cl_ulong4 bitxor;
+    for (int i = 0; i < 4; i++)
+        bitxor.s[i] = (idesc1.s[i] ^ idesc2.s[i]);
+    return bitCountULong4(bitxor);
+}
+
+template<>
+inline int errorBitDescriptors<cl_ulong4>(cl_ulong4 const & tdesc, cl_ulong4 const & rdesc) {
+    cl_ulong4 trand;
+    for (int i = 0; i < 4; i++)
+        trand.s[i] = (tdesc.s[i] & ~rdesc.s[i]);
+    return bitCountULong4(trand);
+}
+
 } // namespace CL
 } // namespace CVD
 
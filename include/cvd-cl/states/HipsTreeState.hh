@@ -78,24 +78,16 @@ public:
     /// \brief Calculated tree shape.
     HipsTreeShape const shape;
 
-    /// \brief OpenCL image object for HIPS descriptor forest.
+    /// \brief OpenCL buffer object for HIPS descriptor forest.
     ///
-    /// Each pixel is an RGBA of 32-bit unsigned integers, 128 bits in total.
-    /// Each row is a 256 bit HIPS descriptor, contiguous in host-side memory.
-    ///
-    /// height = nKeepNodes
-    /// width  = 2
-    ///
-    /// This order is used to keep cl_ulong4 elements adjacent.
-    cl::Image2D    tree;
+    /// Holds shape.nKeepNodes descriptors, starting from
+    /// node shape.nDropNodes of the full tree.
+    cl::Buffer     tree;
 
-    /// \brief OpenCL image object for the original index of each tree leaf.
-    ///
-    /// Each pixel is an RGBA of 16-bit unsigned integers, only .x of which is used.
+    /// \brief OpenCL buffer object for the original index of each tree leaf.
     ///
-    /// height = nLeaves
-    /// width  = 1
-    cl::Image2D    maps;
+    /// Holds shape.nLeaves 16-bit unsigned integers.
+    cl::Buffer     maps;
 };
 
 } // namespace CL
@@ -74,11 +74,20 @@ protected:
     /// \brief Option to test rotations of the HIPS test descriptors.
     bool    const    rotate;
 
+    /// \brief Number of work items in each work group, each testing one descriptor.
+    ///
+    /// At least one full wavefront (64) where the device allows it,
+    /// since each work item tests every rotation itself.
+    size_t  const    nlocal;
+
     /// \brief OpenCL program.
     cl::Program      program;
 
     /// \brief OpenCL kernel.
     cl::Kernel       kernel;
+
+    /// \brief Number of work groups that can be resident on the device at once.
+    size_t           nresident;
 };
 
 } // namespace CL
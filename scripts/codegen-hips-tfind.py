@@ -48,97 +48,324 @@ print """// Copyright (C) 2011  Dmitri Nikulin
 // FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
 // OTHER DEALINGS IN THE SOFTWARE.
 
+#if defined(__OPENCL_C_VERSION__) && (__OPENCL_C_VERSION__ >= 200)
+
+// HipsTreeFindStep passes -cl-std=CL2.0 to devices reporting OpenCL C 2.x.
+// Use scoped atomics, so that the local counter never pays for device scope.
+// Ordering between work items is provided by barriers, so relaxed is enough.
+typedef atomic_uint hips_counter;
+
+#define HIPS_LOCAL_INIT(p, n) atomic_init((p), (n))
+#define HIPS_LOCAL_SET(p, n)  atomic_store_explicit((p), (n), memory_order_relaxed, memory_scope_work_group)
+#define HIPS_LOCAL_GET(p)     atomic_load_explicit((p), memory_order_relaxed, memory_scope_work_group)
+#define HIPS_LOCAL_INC(p)     atomic_fetch_add_explicit((p), 1u, memory_order_relaxed, memory_scope_work_group)
+#define HIPS_LOCAL_ADD(p, n)  atomic_fetch_add_explicit((p), (n), memory_order_relaxed, memory_scope_work_group)
+#define HIPS_GLOBAL_ADD(p, n) atomic_fetch_add_explicit((global atomic_uint *) (p), (n), memory_order_relaxed, memory_scope_device)
+
+#elif defined(cl_khr_local_int32_base_atomics)
+
 // Enable OpenCL 32-bit integer atomic functions.
 #pragma OPENCL EXTENSION cl_khr_global_int32_base_atomics : enable
+#pragma OPENCL EXTENSION cl_khr_local_int32_base_atomics : enable
+
+typedef uint hips_counter;
+
+#define HIPS_LOCAL_INIT(p, n) (*(p) = (n))
+#define HIPS_LOCAL_SET(p, n)  (*(p) = (n))
+#define HIPS_LOCAL_GET(p)     (*(p))
+#define HIPS_LOCAL_INC(p)     atom_inc(p)
+#define HIPS_LOCAL_ADD(p, n)  atom_add((p), (n))
+#define HIPS_GLOBAL_ADD(p, n) atom_add((p), (n))
+
+#else
+
+// Local atomics are optional in OpenCL 1.0. Without them the local
+// buffer always reports itself full, so every match is appended
+// directly to global memory and the buffered count stays zero.
+#pragma OPENCL EXTENSION cl_khr_global_int32_base_atomics : enable
+
+typedef uint hips_counter;
+
+#define HIPS_LOCAL_INIT(p, n) (*(p) = (n))
+#define HIPS_LOCAL_SET(p, n)  (*(p) = (n))
+#define HIPS_LOCAL_GET(p)     (0u)
+#define HIPS_LOCAL_INC(p)     ((uint) HIPS_LOCAL_MATCHES)
+#define HIPS_LOCAL_ADD(p, n)  ((uint) HIPS_LOCAL_MATCHES)
+#define HIPS_GLOBAL_ADD(p, n) atom_add((p), (n))
+
+#endif
+
+// Where sub-groups are available, matches are committed with one
+// local atomic per sub-group rather than one per matching work item.
+// cl_khr_subgroups is an OpenCL C 2.0 extension, reached through the
+// -cl-std=CL2.0 option HipsTreeFindStep gives to 2.x devices.
+#if defined(__OPENCL_C_VERSION__) && (__OPENCL_C_VERSION__ >= 200) && defined(cl_khr_subgroups)
+#pragma OPENCL EXTENSION cl_khr_subgroups : enable
+#define HIPS_SUBGROUPS 1
+#endif
+
+// Tree shape and threshold must be literal build options (see HipsTreeFindStep),
+// so that both descent loops can be fully unrolled and constant-folded.
+#ifndef TREE_LEVELS
+#error "TREE_LEVELS must be defined at build time"
+#endif
+#ifndef TREE_PRE_ROOTS
+#error "TREE_PRE_ROOTS must be defined at build time"
+#endif
+#ifndef TREE_DROP_NODES
+#error "TREE_DROP_NODES must be defined at build time"
+#endif
+#ifndef TREE_LEAF0
+#error "TREE_LEAF0 must be defined at build time"
+#endif
+#ifndef HIPS_MAX_ERROR
+#error "HIPS_MAX_ERROR must be defined at build time"
+#endif
+#ifndef HIPS_ROTATIONS
+#error "HIPS_ROTATIONS must be defined at build time"
+#endif
+#ifndef TREE_LOCAL_LEVELS
+#error "TREE_LOCAL_LEVELS must be defined at build time"
+#endif
+#ifndef HIPS_GROUP_SIZE
+#error "HIPS_GROUP_SIZE must be defined at build time"
+#endif
+
+// Upper levels of the forest are visited by every work item,
+// so they are shared through local memory by each work group.
+// Kept nodes are stored level by level, so the first TREE_LOCAL_LEVELS
+// levels are simply the first TREE_LOCAL_NODES nodes.
+#define TREE_LOCAL_NODES ((TREE_PRE_ROOTS * 2) * ((1 << TREE_LOCAL_LEVELS) - 1))
+
+#if TREE_LOCAL_LEVELS > 0
+#define TREE_NODE(inode, idepth) (((idepth) < TREE_LOCAL_LEVELS) ? ltree[inode] : hashesR[inode])
+#else
+#define TREE_NODE(inode, idepth) (hashesR[inode])
+#endif
+
+// Explicit unroll factors, since some compilers ignore a bare "#pragma unroll"
+// when they cannot work out the trip count. A pragma argument is not
+// macro-expanded, so the factor is stringised through _Pragma instead.
+// Build with -D'HIPS_UNROLL(n)=' to leave unrolling to the compiler.
+#ifndef HIPS_UNROLL
+#define HIPS_PRAGMA(x) _Pragma(#x)
+#define HIPS_UNROLL(n) HIPS_PRAGMA(unroll n)
+#endif
+
+// Rotations unrolled per iteration, keeping the descent within registers.
+// Full unrolling would multiply the descent by HIPS_ROTATIONS and spill.
+#ifndef HIPS_ROTATION_UNROLL
+#define HIPS_ROTATION_UNROLL 4
+#endif
+
+// Matches buffered in local memory per work group before publishing.
+#ifndef HIPS_LOCAL_MATCHES
+#define HIPS_LOCAL_MATCHES 256
+#endif
+
+#if defined(__OPENCL_C_VERSION__) && (__OPENCL_C_VERSION__ >= 120)
+
+// Use the OpenCL 1.2 built-in, usually a single instruction per lane.
+uint bitcount(ulong4 v) {
+    ulong4 const p = popcount(v);
+    return (uint) (p.x + p.y + p.z + p.w);
+}
+
+#else
 
 // Parallel bit counting magic adapted from
 // http://graphics.stanford.edu/~seander/bithacks.html#CountBitsSetParallel
-uint bitcount8(uint8 v) {
-    v = (v - ((v >> 1) & 0x55555555));
-    v = ((v & 0x33333333) + ((v >> 2) & 0x33333333));
-    v = ((((v + (v >> 4)) & 0xF0F0F0F) * 0x1010101) >> 24);
-
-    // Fold together in halves.
-    uint4 v4 = (v.lo + v.hi);
-    return (v4.x + v4.y + v4.z + v4.w);
+uint bitcount(ulong4 v) {
+    v = (v - ((v >> 1) & 0x5555555555555555UL));
+    v = ((v & 0x3333333333333333UL) + ((v >> 2) & 0x3333333333333333UL));
+    v = ((((v + (v >> 4)) & 0x0F0F0F0F0F0F0F0FUL) * 0x0101010101010101UL) >> 56);
+
+    return (uint) (v.x + v.y + v.z + v.w);
 }
 
-uint error(uint8 t, uint8 r) {
-    return bitcount8(t & ~r);
+#endif
+
+uint error(ulong4 t, ulong4 r) {
+    return bitcount(t & ~r);
 }
 
 kernel void hips_tree_find(
-    read_only image2d_t     hashesR,  // R (forest of descriptors, as above)
-    read_only image2d_t     indices,  // Original index of each hash in R, defined only for leaves.
-    global   ulong4 const * hashesT,  // T (list of descriptors)
-    global   uint2        * matches,  // Pairs of indices into hashes1 and hashes2.
-    global   uint         * imatch,   // Output number of hash1 matches.
-             uint           nmatch    // Maximum number of matches.
+    global   ulong4 const * restrict hashesR,  // R (forest of descriptors, as above)
+    global   ushort const * restrict indices,  // Original index of each leaf in R.
+    global   ulong4 const * restrict hashesT,  // T (list of descriptors)
+    global   uint2        *          matches,  // Pairs of indices into hashes1 and hashes2.
+    global   uint         *          imatch,   // Output number of hash1 matches.
+             uint                    nmatch,   // Maximum number of matches.
+             uint                    nhash     // Number of test descriptors in T.
 ) {
 
-    // Prepare a suitable OpenCL image sampler.
-    sampler_t const sampler = CLK_ADDRESS_CLAMP | CLK_FILTER_NEAREST;
-
-    // Use global work item in dimension 0 for hashT index.
-    uint   const ihashT  = get_global_id(0);
-    ulong4 const  hashT0 = hashesT[ihashT];
-
-    // Use global work item in dimension 1 for rotation index.
-    uint   const ishift  = get_global_id(1);
-    uint   const lshift  = (ishift * 4);
-    uint   const rshift  = (64 - lshift);
-
-    // Rotate and cast descriptor.
-    uint8 const  hashT  = as_uint8((hashT0 >> rshift) | (hashT0 << lshift));
-
-    // Loop over pre-roots.
-    #pragma unroll
-    for (uint iroot = 0; iroot < TREE_PRE_ROOTS; iroot++) {
-        // Start traversal at root.
-        uint icell = (iroot + TREE_PRE_ROOTS - 1);
-        uint last  = 10000;
-
-        // Recurse within available tree levels..
-        #pragma unroll
-        for (uint idepth = 0; idepth < TREE_LEVELS; idepth++) {
-            // Calculate positions of both children.
-            uint const icell0 = (icell  * 2);
+    // Flat index of the work item and the work group.
+    uint   const ilocal  = get_local_id(0);
+    uint   const igroup  = get_group_id(0);
+
+    // Work groups step through the test descriptors together.
+    uint   const stride  = mul24((uint) get_num_groups(0), (uint) HIPS_GROUP_SIZE);
+
+    // Matches are counted and buffered for the whole work group,
+    // so that only one global atomic is needed per block of descriptors.
+    local  hips_counter lcount;
+    local  uint  lbase;
+    local  uint2 lbuf[HIPS_LOCAL_MATCHES];
+
+    if (ilocal == 0)
+        HIPS_LOCAL_INIT(&lcount, 0u);
+
+    // Test descriptors for this work group, double-buffered so that
+    // the next block is copied while the current block is searched.
+    local  ulong4 lhashT[2][HIPS_GROUP_SIZE];
+
+    // Start copying the first block of test descriptors.
+    uint    base    = mul24(igroup, (uint) HIPS_GROUP_SIZE);
+    uint    const n0 = (base < nhash) ? min((uint) HIPS_GROUP_SIZE, nhash - base) : 0;
+    event_t fetched = async_work_group_copy(lhashT[0], hashesT + base, n0, 0);
+
+#if TREE_LOCAL_LEVELS > 0
+    // Copy upper levels of the forest to local memory.
+    local  ulong4 ltree[TREE_LOCAL_NODES];
+
+    event_t copied = async_work_group_copy(ltree, hashesR, TREE_LOCAL_NODES, 0);
+    wait_group_events(1, &copied);
+#endif
+
+    barrier(CLK_LOCAL_MEM_FENCE);
+
+    for (uint iblock = 0; base < nhash; iblock++, base += stride) {
+        // Local buffer holding the current block.
+        uint const icur = (iblock & 1);
+
+        // Wait for the current block. The other buffer is free,
+        // since the previous block ended with a barrier.
+        wait_group_events(1, &fetched);
+
+        // Start copying the next block into the other buffer.
+        uint const next = (base + stride);
+        if (next < nhash)
+            fetched = async_work_group_copy(lhashT[icur ^ 1], hashesT + next, min((uint) HIPS_GROUP_SIZE, nhash - next), 0);
+
+        // Use work item within the block for hashT index.
+        // Work items past the end of the list discard their matches,
+        // but still take part in flushing the block.
+        uint   const ihashT = (base + ilocal);
+        uint   const valid  = (ihashT < nhash);
+        ulong4 const hashT0 = lhashT[icur][ilocal];
+
+        // Loop over pre-roots, each one a separate subtree.
+        // Kept rolled, since its body already holds the unrolled rotations.
+        HIPS_UNROLL(1)
+        for (uint iroot = 0; iroot < TREE_PRE_ROOTS; iroot++) {
+            // Start traversal at root.
+            uint const icell0 = ((iroot + TREE_PRE_ROOTS - 1) * 2);
             uint const icell1 = (icell0 + 1);
             uint const icell2 = (icell0 + 2);
 
-            // Correct for tree truncation.
-            uint const icell10 = (icell1 - TREE_DROP_NODES);
-            uint const icell20 = (icell2 - TREE_DROP_NODES);
+            // The children of the pre-root are shared by every rotation,
+            // so read them only once.
+            ulong4 const hashR1 = TREE_NODE(icell1 - TREE_DROP_NODES, 0);
+            ulong4 const hashR2 = TREE_NODE(icell2 - TREE_DROP_NODES, 0);
 
-            // Read integers for both children.
-            uint8 hashR1;
-            hashR1.lo = read_imageui(hashesR, sampler, (int2)(0, icell10));
-            hashR1.hi = read_imageui(hashesR, sampler, (int2)(1, icell10));
+            // Loop over rotations, unrolled only partially.
+            HIPS_UNROLL(HIPS_ROTATION_UNROLL)
+            for (uint irot = 0; irot < HIPS_ROTATIONS; irot++) {
+                // Rotate descriptor.
+                ulong4 const hashT  = rotate(hashT0, (ulong4) (irot * 4));
 
-            uint8 hashR2;
-            hashR2.lo = read_imageui(hashesR, sampler, (int2)(0, icell20));
-            hashR2.hi = read_imageui(hashesR, sampler, (int2)(1, icell20));
+                // Calculate errors for both children of the pre-root.
+                uint const err1 = error(hashT, hashR1);
+                uint const err2 = error(hashT, hashR2);
 
-            // Calculate errors for both children.
-            uint const err1 = error(hashT, hashR1);
-            uint const err2 = error(hashT, hashR2);
+                // Determine lower error, keeping child with lower error.
+                uint last  = min(err1, err2);
+                uint icell = select(icell1, icell2, err1 > err2);
 
-            // Determine lower error.
-            last = min(err1, err2);
+                // Recurse within remaining tree levels, where rotations diverge.
+                HIPS_UNROLL((TREE_LEVELS - 1))
+                for (uint idepth = 1; idepth < TREE_LEVELS; idepth++) {
+                    // Calculate positions of both children.
+                    uint const icell0 = (icell  * 2);
+                    uint const icell1 = (icell0 + 1);
+                    uint const icell2 = (icell0 + 2);
 
-            // Keep child with lower error.
-            icell = select(icell1, icell2, err1 > err2);
-        }
+                    // Read integers for both children (adjacent in memory).
+                    ulong4 const hashR1 = TREE_NODE(icell1 - TREE_DROP_NODES, idepth);
+                    ulong4 const hashR2 = TREE_NODE(icell2 - TREE_DROP_NODES, idepth);
+
+                    // Calculate errors for both children.
+                    uint const err1 = error(hashT, hashR1);
+                    uint const err2 = error(hashT, hashR2);
+
+                    // Determine lower error.
+                    last  = min(err1, err2);
 
-        // Record match if within error threshold.
-        if (last <= HIPS_MAX_ERROR) {
-            uint const i = atom_inc(imatch);
-            if (i < nmatch) {
-                uint const index = read_imageui(indices, sampler, (int2)(0, icell - TREE_LEAF0)).x;
+                    // Keep child with lower error.
+                    icell = select(icell1, icell2, err1 > err2);
+                }
 
-                // Store pair against original index.
-                matches[i] = (uint2)(index, ihashT);
+                // Record match if within error threshold.
+                uint const flag = (valid && (last <= HIPS_MAX_ERROR));
+
+#ifdef HIPS_SUBGROUPS
+                // Reserve local buffer space once for the whole sub-group.
+                uint const woff   = sub_group_scan_exclusive_add(flag);
+                uint const wcount = sub_group_reduce_add(flag);
+
+                uint wbase = 0;
+                if ((get_sub_group_local_id() == 0) && (wcount > 0))
+                    wbase = HIPS_LOCAL_ADD(&lcount, wcount);
+
+                uint const li = (sub_group_broadcast(wbase, 0) + woff);
+#endif
+
+                if (flag) {
+                    // Pair test descriptor with original index.
+                    uint2 const pair = (uint2)(indices[icell - TREE_LEAF0], ihashT);
+
+#ifndef HIPS_SUBGROUPS
+                    uint const li = HIPS_LOCAL_INC(&lcount);
+#endif
+                    if (li < HIPS_LOCAL_MATCHES) {
+                        // Buffer pair in local memory.
+                        lbuf[li] = pair;
+                    } else {
+                        // Local buffer is full, store pair directly.
+                        uint const i = HIPS_GLOBAL_ADD(imatch, 1u);
+                        if (i < nmatch)
+                            matches[i] = pair;
+                    }
+                }
             }
         }
+
+        // Flush the block's matches, so the local buffer
+        // only ever holds one block's worth of pairs.
+        barrier(CLK_LOCAL_MEM_FENCE);
+
+        // Number of pairs buffered in local memory.
+        uint const nbuf = min((uint) HIPS_LOCAL_GET(&lcount), (uint) HIPS_LOCAL_MATCHES);
+
+        // Reserve output space for the whole block.
+        if (ilocal == 0)
+            lbase = HIPS_GLOBAL_ADD(imatch, nbuf);
+
+        barrier(CLK_LOCAL_MEM_FENCE);
+
+        // Copy buffered pairs to output as one contiguous block,
+        // clamped to the space left in the output.
+        uint    const start   = min(lbase, nmatch);
+        uint    const nout    = min(nbuf, nmatch - start);
+        event_t       flushed = async_work_group_copy(matches + start, lbuf, nout, 0);
+        wait_group_events(1, &flushed);
+
+        barrier(CLK_LOCAL_MEM_FENCE);
+
+        // Empty the local buffer for the next block.
+        if (ilocal == 0)
+            HIPS_LOCAL_SET(&lcount, 0u);
+
+        barrier(CLK_LOCAL_MEM_FENCE);
     }
 }"""
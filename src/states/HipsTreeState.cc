@@ -33,17 +33,12 @@
 namespace CVD {
 namespace CL  {
 
-cl::ImageFormat static const HipsFormat(CL_RGBA, CL_UNSIGNED_INT32);
-cl::ImageFormat static const MapsFormat(CL_RGBA, CL_UNSIGNED_INT16);
-
-cl_ushort4 static const cl_ushort4_0 = {{0, 0, 0, 0}};
-
 HipsTreeState::HipsTreeState(Worker & worker, cl_uint nLeaves, cl_uint nKeepLevels) :
     WorkerState (worker),
     shape       (nLeaves, nKeepLevels),
-    // Allocate image objects.
-    tree        (worker.context, CL_MEM_READ_ONLY, HipsFormat, 2, shape.nFullNodes),
-    maps        (worker.context, CL_MEM_READ_ONLY, MapsFormat, 1, shape.nLeaves)
+    // Allocate buffer objects.
+    tree        (worker.context, CL_MEM_READ_ONLY, shape.nKeepNodes * sizeof(cl_ulong4)),
+    maps        (worker.context, CL_MEM_READ_ONLY, shape.nLeaves    * sizeof(cl_ushort))
 {
     // Do nothing.
 }
@@ -57,23 +52,10 @@ void HipsTreeState::setTree(std::vector<cl_ulong4> const & list) {
 
     lastTree = list;
 
-    cl::size_t<3> origin;
-    origin[0] = 0;
-    origin[1] = 0;
-    origin[2] = 0;
-
-    cl::size_t<3> region;
-    region[0] = 2;
-    region[1] = shape.nKeepNodes;
-    region[2] = 1;
-
-    // Cast to non-const void due to error in cl.hpp.
-    cl_ulong4 * data = const_cast<cl_ulong4 *>(list.data());
-
     // Offset to avoid skipped nodes.
-    cl_ulong4 * start = (data + shape.nDropNodes);
+    cl_ulong4 const * start = (list.data() + shape.nDropNodes);
 
-    worker.queue.enqueueWriteImage(tree, CL_TRUE, origin, region, 0, 0, start);
+    worker.queue.enqueueWriteBuffer(tree, CL_TRUE, 0, shape.nKeepNodes * sizeof(cl_ulong4), start);
 }
 
 void HipsTreeState::setMaps(std::vector<cl_ushort> const & list) {
@@ -81,25 +63,7 @@ void HipsTreeState::setMaps(std::vector<cl_ushort> const & list) {
 
     lastMaps = list;
 
-    cl::size_t<3> origin;
-    origin[0] = 0;
-    origin[1] = 0;
-    origin[2] = 0;
-
-    cl::size_t<3> region;
-    region[0] = 1;
-    region[1] = shape.nLeaves;
-    region[2] = 1;
-
-    // Extend to RGBA.
-    std::vector<cl_ushort4> list4(shape.nLeaves, cl_ushort4_0);
-    for (size_t i = 0; i < shape.nLeaves; i++)
-        list4.at(i).x = list.at(i);
-
-    // Cast to non-const void due to error in cl.hpp.
-    cl_ushort4 * data = const_cast<cl_ushort4 *>(list4.data());
-
-    worker.queue.enqueueWriteImage(maps, CL_TRUE, origin, region, 0, 0, data);
+    worker.queue.enqueueWriteBuffer(maps, CL_TRUE, 0, shape.nLeaves * sizeof(cl_ushort), list.data());
 }
 
 } // namespace CL
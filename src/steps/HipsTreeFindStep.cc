@@ -27,6 +27,8 @@
 #include "kernels/hips-tfind.hh"
 
 #include <algorithm>
+#include <cstdio>
+#include <string>
 
 #ifdef CVD_CL_VERBOSE
 #include <iomanip>
@@ -42,7 +44,8 @@ HipsTreeFindStep::HipsTreeFindStep(HipsTreeState & i_tree, HipsListState & i_hip
     i_hips     (i_hips),
     o_matches  (o_matches),
     maxerr     (maxerr),
-    rotate     (rotate)
+    rotate     (rotate),
+    nlocal     (std::min(worker.defaultLocalSize, size_t(64)))
 {
 
     // Refer to tree shape.
@@ -51,13 +54,49 @@ HipsTreeFindStep::HipsTreeFindStep(HipsTreeState & i_tree, HipsListState & i_hip
     // Number of "pre-roots", pairing roots in the forest.
     cl_uint const nPreRoot = (shape.nTreeRoots / 2);
 
+    // Number of rotations tested within each work item.
+    cl_uint const nRotate  = (rotate ? 16 : 1);
+
+    // Cache as many upper levels of the forest in local memory
+    // as fit within a quarter of the device's local memory.
+    cl_ulong const localBytes = (worker.device.getInfo<CL_DEVICE_LOCAL_MEM_SIZE>() / 4);
+
+    cl_uint nLocalLevels = 0;
+    while ((nLocalLevels < shape.nKeepLevels) &&
+           ((shape.nTreeRoots * ((2 << nLocalLevels) - 1) * sizeof(cl_ulong4)) <= localBytes))
+        nLocalLevels++;
+
+    // Compile as OpenCL C 2.0 where the device supports it, enabling
+    // scoped atomics and sub-groups in the kernel. Without this option
+    // compilers default to OpenCL C 1.x. OpenCL C 3.0 makes those
+    // features optional, so only 2.x devices are given the option.
+    char const * clstd = "";
+
+#ifdef CL_DEVICE_OPENCL_C_VERSION
+    std::string const version = worker.device.getInfo<CL_DEVICE_OPENCL_C_VERSION>();
+
+    int major = 0;
+    int minor = 0;
+    if ((sscanf(version.c_str(), "OpenCL C %d.%d", &major, &minor) == 2) && (major == 2))
+        clstd = " -cl-std=CL2.0";
+#endif
+
     // Format OpenCL compiler options.
+    // These must be literals for the kernel to unroll its descent loops.
     char opt[512] = {0,};
     snprintf(opt, sizeof(opt) - 1,
-        "-DHIPS_MAX_ERROR=%d -DTREE_PRE_ROOTS=%d -DTREE_LEVELS=%d -DTREE_DROP_NODES=%d -DTREE_LEAF0=%d",
-        int(maxerr), int(nPreRoot), int(shape.nKeepLevels), int(shape.nDropNodes), int(shape.iTreeLeaf0));
+        "-DHIPS_MAX_ERROR=%d -DHIPS_ROTATIONS=%d -DTREE_PRE_ROOTS=%d -DTREE_LEVELS=%d -DTREE_LOCAL_LEVELS=%d -DTREE_DROP_NODES=%d -DTREE_LEAF0=%d -DHIPS_GROUP_SIZE=%d%s",
+        int(maxerr), int(nRotate), int(nPreRoot), int(shape.nKeepLevels), int(nLocalLevels), int(shape.nDropNodes), int(shape.iTreeLeaf0), int(nlocal), clstd);
 
     worker.compile(&program, &kernel, OCL_HIPS_TFIND, "hips_tree_find", opt);
+
+    // Local memory bounds how many work groups share each compute unit,
+    // as the kernel stages the forest and test descriptors there.
+    cl_ulong const unitBytes  = worker.device.getInfo<CL_DEVICE_LOCAL_MEM_SIZE>();
+    cl_ulong const groupBytes = std::max(kernel.getWorkGroupInfo<CL_KERNEL_LOCAL_MEM_SIZE>(worker.device), cl_ulong(1));
+    size_t   const nperunit   = std::max(size_t(unitBytes / groupBytes), size_t(1));
+
+    nresident = (worker.device.getInfo<CL_DEVICE_MAX_COMPUTE_UNITS>() * nperunit);
 }
 
 HipsTreeFindStep::~HipsTreeFindStep() {
@@ -112,18 +151,21 @@ void HipsTreeFindStep::execute() {
     // Read number of descriptors.
     size_t const nh = i_hips.getCount();
 
-    // Round down number of descriptors.
-    size_t const nh_16 = (nh / 16) * 16;
+    // Reset number of output pairs.
+    o_matches.setCount(0);
 
-    // Set number of rotations by parameter.
-    size_t const nr = (rotate ? 16 : 1);
+    if (nh < 1)
+        return;
 
-    // Calculate local size in first dimension.
-    size_t const local1 = std::min((worker.defaultLocalSize / nr), size_t(16));
+    // Launch as many work groups as can be resident at once,
+    // each stepping through blocks of descriptors so that
+    // the next block is fetched while the current one is searched.
+    size_t const nblocks = ((nh + nlocal - 1) / nlocal);
+    size_t const ngroups = std::min(nblocks, nresident);
 
-    // Create 1D work size.
-    cl::NDRange const global(nh_16, nr);
-    cl::NDRange const local(local1, nr);
+    // Create 1D work size, each work item testing all rotations.
+    cl::NDRange const global(ngroups * nlocal);
+    cl::NDRange const local(nlocal);
 
     // Assign kernel parameters.
     kernel.setArg(0, i_tree.tree);
@@ -132,11 +174,9 @@ void HipsTreeFindStep::execute() {
     kernel.setArg(3, o_matches.buffer);
     kernel.setArg(4, o_matches.count);
     kernel.setArg(5, o_matches.size);
+    kernel.setArg(6, cl_uint(nh));
 
-    // Reset number of output pairs.
-    o_matches.setCount(0);
-
-    // Queue kernel with global size set to number of input points in the test list.
+    // Queue kernel with global size covering a block of descriptors per work group.
     worker.queue.enqueueNDRangeKernel(kernel, cl::NullRange, global, local);
 
 #ifdef CVD_CL_VERBOSE